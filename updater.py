@@ -1,9 +1,15 @@
 import os
+import re
 import json
+import time
 import logging
 import argparse
+import subprocess
 from unidiff import PatchSet
-from typing import Optional, Dict
+from unidiff.constants import LINE_TYPE_ADDED, LINE_TYPE_CONTEXT, LINE_TYPE_REMOVED
+from itertools import islice, repeat
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Dict, Iterable, Iterator
 
 import requests
 from requests.models import Response
@@ -11,15 +17,92 @@ from requests.adapters import HTTPAdapter
 from requests.exceptions import HTTPError, RequestException
 from urllib3.util.retry import Retry
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+DIFF_HEADER_START = b"diff --git "
+HUNK_START = b"@@"
+ASSETS_PREFIX_RE = re.compile(rb'(?<=[ "])([ab]/)?assets/')
+ASSETS_PATH_RE = re.compile(rb'[ "][ab]/assets/')
+
+
+def _json_loads(data):
+    """
+    Parse JSON with orjson when available, falling back to the standard library.
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def _json(response: Response):
+    """
+    Parse the JSON body of a response.
+    """
+    return _json_loads(response.content)
+
+
+def _unquote_git_path(path: str) -> str:
+    """
+    Decode a path that git wrapped in quotes because of special or non-ASCII characters.
+    """
+    if len(path) < 2 or not (path.startswith('"') and path.endswith('"')):
+        return path
+    # git 将 UTF-8 字节写成八进制转义，如 "\346\226\260.txt"
+    return (
+        path[1:-1]
+        .encode("utf-8")
+        .decode("unicode_escape")
+        .encode("latin-1")
+        .decode("utf-8")
+    )
+
+
+def _write_atomic(path: str, content: str) -> None:
+    """
+    Write the content to a temporary file and move it over the target in one step.
+    """
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as file:
+        file.write(content)
+    os.replace(tmp_path, path)
+
+
+class GitHubHTTPError(Exception):
+    """
+    An error response from the GitHub API, keeping its HTTP status code.
+    """
+
+    def __init__(self, message: str, status_code: int) -> None:
+        super().__init__(message)
+        self.status_code = status_code
+
 
 class MaaFrameworkUpdater:
     BASE_URL = "https://api.github.com"
     CHECK_TOKEN_VALIDITY_URL = BASE_URL + "/user"
-    RELEASES_URL_TEMPLATE = BASE_URL + "/repos/{repo}/releases"
+    REPO_URL_TEMPLATE = BASE_URL + "/repos/{repo}"
+    RELEASES_URL_TEMPLATE = REPO_URL_TEMPLATE + "/releases"
     COMPARE_URL_TEMPLATE = (
         BASE_URL + "/repos/{repo}/compare/{current_version}...{latest_version}"
     )
+    GRAPHQL_URL = BASE_URL + "/graphql"
+    RATE_LIMIT_MAX_WAIT = 60
     DEFAULT_HEADERS = {"Accept": "application/vnd.github+json"}
+    DIFF_HEADERS = {"Accept": "application/vnd.github.v3.diff"}
+    RELEASES_QUERY = """
+    query($owner: String!, $name: String!, $first: Int!, $after: String) {
+      repository(owner: $owner, name: $name) {
+        releases(first: $first, after: $after, orderBy: {field: CREATED_AT, direction: DESC}) {
+          nodes { tagName isPrerelease description }
+          pageInfo { endCursor hasNextPage }
+        }
+      }
+    }
+    """
 
     def __init__(
         self,
@@ -33,6 +116,8 @@ class MaaFrameworkUpdater:
         """
         self.base_dir = base_dir
         self.repo = None
+        self._owner_name = None
+        self._releases_cache = {}
         self.prerelease = prerelease
         self.current_version = None
         self.latest_version = None
@@ -43,12 +128,32 @@ class MaaFrameworkUpdater:
             self.headers["Authorization"] = "Bearer " + token
 
         self.session = requests.Session()
-        retries = Retry(total=5, backoff_factor=1, status_forcelist=[502, 503, 504])
-        self.session.mount("https://", HTTPAdapter(max_retries=retries))
+        retries = Retry(
+            total=6,
+            backoff_factor=1.5,
+            status_forcelist=[429, 502, 503, 504],
+            allowed_methods=frozenset(["GET", "POST"]),
+            respect_retry_after_header=True,
+        )
+        # 连接池需不小于并发请求数，避免 keep-alive 连接被丢弃重建
+        self.session.mount(
+            "https://",
+            HTTPAdapter(max_retries=retries, pool_connections=16, pool_maxsize=32),
+        )
 
         os.makedirs(self.base_dir, exist_ok=True)
         os.makedirs(os.path.join(self.base_dir, self.diff_dir), exist_ok=True)
 
+        self._etag_cache_file = os.path.join(
+            self.base_dir, self.diff_dir, ".etag_cache.json"
+        )
+        self._etag_cache_dirty = False
+        try:
+            with open(self._etag_cache_file, "rb") as file:
+                self._etag_cache = _json_loads(file.read())
+        except (FileNotFoundError, json.JSONDecodeError):
+            self._etag_cache = {}
+
         log_dir = os.path.join(self.base_dir, "debug")
         os.makedirs(log_dir, exist_ok=True)
         log_file = os.path.join(log_dir, "update.log")
@@ -65,12 +170,12 @@ class MaaFrameworkUpdater:
         Read the interface file to get the current version and repository name.
         """
         try:
-            with open(
-                os.path.join(self.base_dir, "interface.json"), "r", encoding="utf-8"
-            ) as file:
-                data = json.load(file)
+            # 一次性读取原始字节交给 JSON 解析器，省去文本层的解码和分块读取
+            with open(os.path.join(self.base_dir, "interface.json"), "rb") as file:
+                data = _json_loads(file.read())
             self.current_version = data["version"]
-            self.repo = "/".join(data["url"].split("/")[-2:])
+            self._owner_name = tuple(data["url"].rstrip("/").rsplit("/", 2)[-2:])
+            self.repo = "/".join(self._owner_name)
             return True
         except FileNotFoundError:
             logging.error("interface.json file not found.")
@@ -91,258 +196,525 @@ class MaaFrameworkUpdater:
             return True
         elif response.status_code == 401:
             logging.error(
-                f"Unauthorized: {response.status_code} - {response.json().get('message')}"
+                f"Unauthorized: {response.status_code} - {_json(response).get('message')}"
             )
         elif response.status_code == 403:
             logging.error(
-                f"Forbidden: {response.status_code} - {response.json().get('message')}"
+                f"Forbidden: {response.status_code} - {_json(response).get('message')}"
             )
         elif response.status_code == 404:
             logging.error(
-                f"Not Found: {response.status_code} - {response.json().get('message')}"
+                f"Not Found: {response.status_code} - {_json(response).get('message')}"
             )
         else:
             logging.error(
-                f"HTTP error occurred: {response.status_code} - {response.json().get('message')}"
+                f"HTTP error occurred: {response.status_code} - {_json(response).get('message')}"
             )
         return False
 
-    def get_request_response(self, url: str, params: Optional[Dict] = None) -> Response:
+    def _save_etag_cache(self) -> None:
         """
-        Send a GET request and handle potential errors.
+        Persist the ETag cache if it changed since it was last saved.
         """
-        if params is None:
-            params = {}
+        if not self._etag_cache_dirty:
+            return
+        try:
+            _write_atomic(
+                self._etag_cache_file, json.dumps(self._etag_cache, ensure_ascii=False)
+            )
+            self._etag_cache_dirty = False
+        except OSError as e:
+            logging.warning(f"Failed to save the ETag cache: {e}")
+
+    def _wait_for_rate_limit(self, response: Response) -> bool:
+        """
+        Wait for a GitHub rate limit to reset. Return True if the request should be retried.
+        """
+        if response.status_code != 403:
+            return False
+        # 次级限流给出 Retry-After，主限流给出 X-RateLimit-Reset
+        if "Retry-After" in response.headers:
+            # Retry-After 也可能是 HTTP 日期，无法解析时不等待
+            try:
+                wait = int(response.headers["Retry-After"])
+            except ValueError:
+                return False
+        elif response.headers.get("X-RateLimit-Remaining") == "0":
+            wait = int(response.headers.get("X-RateLimit-Reset", 0)) - time.time()
+        else:
+            return False
+        if wait > self.RATE_LIMIT_MAX_WAIT:
+            logging.error(f"Rate limit exceeded, resets in {int(wait)} seconds.")
+            return False
+        wait = max(wait, 0)
+        logging.warning(f"Rate limit exceeded, retrying in {int(wait)} seconds.")
+        time.sleep(wait)
+        return True
+
+    def _request(
+        self, method: str, url: str, headers: Optional[Dict] = None, **kwargs
+    ) -> Response:
+        """
+        Send a request and handle potential errors.
+        """
+        headers = {**self.headers, **(headers or {})}
         try:
-            response = self.session.get(url=url, headers=self.headers, params=params)
+            response = self.session.request(
+                method=method, url=url, headers=headers, **kwargs
+            )
+            if self._wait_for_rate_limit(response):
+                # 释放连接，否则 stream=True 时该连接不会归还连接池
+                response.close()
+                response = self.session.request(
+                    method=method, url=url, headers=headers, **kwargs
+                )
             response.raise_for_status()
         except HTTPError as http_err:
             status_code = http_err.response.status_code
             if status_code == 401:
-                raise Exception(
-                    f"Unauthorized: {status_code} - {http_err.response.json().get('message')}"
+                raise GitHubHTTPError(
+                    f"Unauthorized: {status_code} - {_json(http_err.response).get('message')}",
+                    status_code,
                 )
             elif status_code == 403:
-                raise Exception(
-                    f"Forbidden: {status_code} - {http_err.response.json().get('message')}"
+                raise GitHubHTTPError(
+                    f"Forbidden: {status_code} - {_json(http_err.response).get('message')}",
+                    status_code,
                 )
             elif status_code == 404:
-                raise Exception(
-                    f"Not Found: {status_code} - {http_err.response.json().get('message')}"
+                raise GitHubHTTPError(
+                    f"Not Found: {status_code} - {_json(http_err.response).get('message')}",
+                    status_code,
                 )
             else:
-                raise Exception(
-                    f"HTTP error occurred with status code: {http_err.response.status_code}"
+                raise GitHubHTTPError(
+                    f"HTTP error occurred with status code: {http_err.response.status_code}",
+                    status_code,
                 ) from http_err
         except RequestException as req_err:
             raise Exception(f"RequestException: {req_err}") from req_err
         return response
 
-    def get_latest_version(self, per_page: int = 5) -> bool:
+    def get_request_response(
+        self,
+        url: str,
+        params: Optional[Dict] = None,
+        headers: Optional[Dict] = None,
+        stream: bool = False,
+    ) -> Response:
         """
-        Get the latest version tag from the GitHub repository.
+        Send a GET request and handle potential errors.
+        """
+        if params is None:
+            params = {}
+        return self._request("GET", url, headers=headers, params=params, stream=stream)
+
+    def _get_cached_json(self, url: str, params: Dict, cache_key: str):
+        """
+        Send a conditional GET request and reuse the cached payload on 304 Not Modified.
+        """
+        cached = self._etag_cache.get(cache_key)
+        headers = {"If-None-Match": cached["etag"]} if cached else None
+        response = self.get_request_response(url=url, params=params, headers=headers)
+        if response.status_code == 304:
+            return cached["data"]
+        data = _json(response)
+        etag = response.headers.get("ETag")
+        if etag:
+            self._etag_cache[cache_key] = {"etag": etag, "data": data}
+            self._etag_cache_dirty = True
+        return data
+
+    def _graphql(self, query: str, variables: Optional[Dict] = None) -> Dict:
+        """
+        Send a GraphQL query and return its data payload.
+        """
+        response = self._request(
+            "POST",
+            self.GRAPHQL_URL,
+            json={"query": query, "variables": variables or {}},
+        )
+        payload = _json(response)
+        if payload.get("errors"):
+            raise Exception(f"GraphQL error: {payload['errors'][0].get('message')}")
+        return payload["data"]
+
+    def _releases_page(self, per_page: int, cursor: Optional[str] = None) -> Dict:
+        """
+        Get one page of releases through GraphQL, memoized for this run.
+        """
+        key = (self.repo, "graphql", per_page, cursor)
+        if key not in self._releases_cache:
+            owner, name = self._owner_name
+            variables = {
+                "owner": owner,
+                "name": name,
+                "first": per_page,
+                "after": cursor,
+            }
+            self._releases_cache[key] = self._graphql(self.RELEASES_QUERY, variables)[
+                "repository"
+            ]["releases"]
+        return self._releases_cache[key]
+
+    def _rest_releases_page(self, page: int, per_page: int) -> list:
         """
-        release_url = self.RELEASES_URL_TEMPLATE.format(repo=self.repo)
-        for page in range(1, 101):
+        Get one page of releases through the REST API, memoized for this run.
+        """
+        key = (self.repo, "rest", per_page, page)
+        if key not in self._releases_cache:
+            release_url = self.RELEASES_URL_TEMPLATE.format(repo=self.repo)
             params = {"per_page": per_page, "page": page}
-            response = self.get_request_response(url=release_url, params=params)
-            tags = response.json()
-            # If there are no more tags, break the loop
-            if not tags:
-                break
-            # Check if the tag is prerelease and if prerelease is needed
-            for tag in tags:
-                if tag["prerelease"] and not self.prerelease:
-                    continue
-                self.latest_version = tag["tag_name"]
+            cache_key = f"{self.repo}:releases:{page}:{per_page}"
+            self._releases_cache[key] = self._get_cached_json(
+                release_url, params, cache_key
+            )
+        return self._releases_cache[key]
+
+    def _iter_releases(self, per_page: int = 100) -> Iterator[Dict]:
+        """
+        Yield releases from newest to oldest, fetching the next page only when needed.
+        """
+        # The GraphQL API is only available to authenticated requests
+        if "Authorization" not in self.headers:
+            yield from self._iter_rest_releases(per_page)
+            return
+        cursor, yielded = None, 0
+        while True:
+            try:
+                releases = self._releases_page(per_page, cursor)
+            except Exception as e:
+                logging.warning(f"GraphQL query failed, falling back to REST API: {e}")
+                # 跳过已经通过 GraphQL 返回过的 release
+                yield from islice(self._iter_rest_releases(per_page), yielded, None)
+                return
+            yield from releases["nodes"]
+            yielded += len(releases["nodes"])
+            if not releases["pageInfo"]["hasNextPage"]:
+                return
+            cursor = releases["pageInfo"]["endCursor"]
+
+    def _iter_rest_releases(
+        self, per_page: int = 100, max_workers: int = 8
+    ) -> Iterator[Dict]:
+        """
+        Yield releases from the REST API, fetching pages in concurrent batches.
+        """
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            page, batch = 1, 1
+            while page <= 100:
+                # Double the batch each round so the common case costs one request
+                pages = range(page, min(page + batch, 101))
+                for tags in executor.map(
+                    self._rest_releases_page, pages, repeat(per_page)
+                ):
+                    # If there are no more tags, stop
+                    if not tags:
+                        return
+                    for tag in tags:
+                        yield {
+                            "tagName": tag["tag_name"],
+                            "isPrerelease": tag["prerelease"],
+                            "description": tag["body"],
+                        }
+                page, batch = page + batch, min(batch * 2, max_workers)
+
+    def get_latest_version(self, per_page: int = 100) -> bool:
+        """
+        Get the latest version tag from the GitHub repository.
+        """
+        # The latest release endpoint already skips prereleases
+        if not self.prerelease:
+            latest_url = self.RELEASES_URL_TEMPLATE.format(repo=self.repo) + "/latest"
+            try:
+                response = self.get_request_response(url=latest_url)
+            except GitHubHTTPError as e:
+                if e.status_code != 404:
+                    raise
+                # 仓库没有正式版时该接口也返回 404；仓库本身不存在时此处会继续抛出 404
+                self.get_request_response(
+                    url=self.REPO_URL_TEMPLATE.format(repo=self.repo)
+                )
+                logging.error(f"No release found in {self.repo}.")
+                return False
+            self.latest_version = _json(response)["tag_name"]
+            return True
+        try:
+            for release in self._iter_releases(per_page):
+                self.latest_version = release["tagName"]
                 return True
-        # Invalid tag
-        return False
+            # Invalid tag
+            return False
+        finally:
+            self._save_etag_cache()
 
-    def generate_changelog(self, per_page: int = 30) -> str:
+    def generate_changelog(self, per_page: int = 100) -> str:
         """
         Generate a changelog from the current version to the latest version.
         """
-        release_url = self.RELEASES_URL_TEMPLATE.format(repo=self.repo)
         changelogs, start_flag = [], False
-        for page in range(1, 101):
-            params = {"per_page": per_page, "page": page}
-            response = self.get_request_response(url=release_url, params=params)
-            tags = response.json()
-            if not tags:
-                return f"Invaild tag! Please redownload in https://github.com/{self.repo}/releases/latest"
-            for tag in tags:
-                if tag["tag_name"] == self.current_version:
+        try:
+            for release in self._iter_releases(per_page):
+                if release["tagName"] == self.current_version:
                     return "\n".join(changelogs)
-                if not start_flag and tag["prerelease"] and not self.prerelease:
+                if not start_flag and release["isPrerelease"] and not self.prerelease:
                     continue
                 start_flag = True
-                changelogs.append(f"# {tag['tag_name']}:\n\n{tag['body']}\n")
-        return "\n".join(changelogs)
+                changelogs.append(
+                    f"# {release['tagName']}:\n\n{release['description']}\n"
+                )
+            return f"Invaild tag! Please redownload in https://github.com/{self.repo}/releases/latest"
+        finally:
+            self._save_etag_cache()
 
-    def get_diff_content(self) -> str:
+    def _fetch_and_write_diff(self) -> None:
         """
-        Get the diff content between two versions.
+        Stream the diff between two versions into the diff file.
         """
         compare_url = self.COMPARE_URL_TEMPLATE.format(
             repo=self.repo,
             current_version=self.current_version,
             latest_version=self.latest_version,
         )
-        try:
-            response = self.get_request_response(url=compare_url)
-            diff_url = response.json()["diff_url"]
-            diff_response = self.get_request_response(url=diff_url)
-            # 确保 diff_response 使用 utf-8 编码
-            diff_content = diff_response.content.decode("utf-8")
-            return diff_content
-        except KeyError:
-            raise Exception("Failed to retrieve the diff URL from the response.")
-
-    def process_diff_content(self, diff_content: str) -> bool:
+        # 直接请求 diff 格式，省去 compare JSON 及二次跳转
+        with self.get_request_response(
+            url=compare_url, headers=self.DIFF_HEADERS, stream=True
+        ) as response:
+            self._write_diff(response.iter_content(chunk_size=65536))
+
+    @staticmethod
+    def _find_line(block: bytes, prefix: bytes, start: int, end: int) -> int:
+        """
+        Find the first line in block[start:end] that begins with prefix, or return -1.
+        """
+        if block.startswith(prefix, start, end) and (
+            start == 0 or block[start - 1] == ord("\n")
+        ):
+            return start
+        index = block.find(b"\n" + prefix, start, end)
+        return index + 1 if index >= 0 else -1
+
+    def _filter_diff_block(self, block: bytes, state: str):
+        """
+        Keep only the files under assets/ in a block of whole lines, stripping the prefix from their headers.
+        Return the processed block and the parser state ("body", "header" or "skip") at its end.
+        """
+        # 每个文件从 "diff --git" 开始，文件头到第一个 "@@" 或下一个 "diff --git" 为止；
+        # 不在 assets/ 下的文件整个跳过，否则 git apply 会因本地不存在而拒绝整个补丁。
+        # 只改写文件头中的路径，hunk 内容原样切片写出
+        # assets/resource & assets/interface.json to resource & interface.json
+        parts, pos, size = [], 0, len(block)
+        search_from = 0
+        while True:
+            if state != "header":
+                start = self._find_line(block, DIFF_HEADER_START, search_from, size)
+                if start < 0:
+                    if state == "body":
+                        parts.append(block[pos:])
+                    return b"".join(parts), state
+                if state == "body":
+                    parts.append(block[pos:start])
+                pos, search_from = start, start + len(DIFF_HEADER_START)
+                line_end = block.find(b"\n", start)
+                line_end = size if line_end < 0 else line_end
+                if ASSETS_PATH_RE.search(block, start, line_end) is None:
+                    state = "skip"
+                    continue
+                state = "header"
+            # 先找最近的 "@@"，再只在文件头范围内查找下一个 "diff --git"
+            end = self._find_line(block, HUNK_START, search_from, size)
+            end = size if end < 0 else end
+            next_header = self._find_line(block, DIFF_HEADER_START, search_from, end)
+            end = end if next_header < 0 else next_header
+            parts.append(ASSETS_PREFIX_RE.sub(rb"\1", block[pos:end]))
+            if end == size:
+                return b"".join(parts), "header"
+            pos, search_from, state = end, end, "body"
+
+    def _write_diff(self, chunks: Iterable[bytes]) -> None:
+        """
+        Process the diff chunks and write them to the diff file.
         """
-        Process the diff content.
+        self.diff_filename = f"{self.current_version}_{self.latest_version}.diff"
+        with open(
+            os.path.join(self.base_dir, self.diff_dir, self.diff_filename), "wb"
+        ) as file:
+            # 按整行处理，避免文件头被 chunk 边界截断
+            buffer, state = b"", "body"
+            for chunk in chunks:
+                data = buffer + chunk
+                cut = data.rfind(b"\n") + 1
+                block, state = self._filter_diff_block(data[:cut], state)
+                file.write(block)
+                buffer = data[cut:]
+            file.write(self._filter_diff_block(buffer, state)[0])
+
+    def _git_apply(self, patch_file_path: str) -> bool:
         """
+        Apply the patch with git apply. Return False if git is unavailable or fails.
+        """
+        # 防止 git 向上找到 base_dir 之外的仓库，否则补丁路径会按该仓库根目录解析
+        env = os.environ.copy()
+        env["GIT_CEILING_DIRECTORIES"] = os.path.dirname(os.path.abspath(self.base_dir))
         try:
-            # assets/resource & assets/interface.json to resource & interface.json
-            processed_content = diff_content.replace("assets/", "")
-            self.diff_filename = f"{self.current_version}_{self.latest_version}.diff"
-            with open(
-                os.path.join(self.base_dir, self.diff_dir, self.diff_filename),
-                "w",
+            subprocess.run(
+                ["git", "apply", "--whitespace=nowarn", patch_file_path],
+                cwd=self.base_dir,
+                env=env,
+                check=True,
+                capture_output=True,
+                # git 输出的路径为 UTF-8，不能按系统区域编码（如 cp936）解码
                 encoding="utf-8",
-            ) as file:
-                file.write(processed_content)
-            return True
-        except Exception as e:
-            logging.error(f"An error occurred while processing the diff: {e}")
+                errors="replace",
+            )
+        except FileNotFoundError:
+            logging.info("git not found, falling back to the built-in patcher.")
             return False
+        except subprocess.CalledProcessError as e:
+            logging.warning(
+                f"git apply failed, falling back to the built-in patcher: {e.stderr.strip()}"
+            )
+            return False
+        logging.info("Patch applied with git apply.")
+        return True
 
-    def apply_patch(self) -> bool:
+    def _local_path(self, path: str) -> str:
         """
-        Apply the patch content to the local files.
+        Resolve a path from the patch against the base directory.
         """
-        try:
-            original_cwd = os.getcwd()
-            os.chdir(self.base_dir)
+        return os.path.join(self.base_dir, path)
 
-            patch_file_path = os.path.join(self.diff_dir, self.diff_filename)
-            with open(
-                patch_file_path,
-                "r",
-                encoding="utf-8",
-            ) as patch_file:
-                patch_content = patch_file.read()
-
-            # 解析补丁
-            patchset = PatchSet.from_string(patch_content)
-            for patched_file in patchset:
-                # 确保文件路径中的非 ASCII 字符正确处理
-                current_file_path = patched_file.path.encode("utf-8").decode(
-                    "unicode_escape"
-                )
-                logging.info(f"Patching file {current_file_path}")
-
-                # remove
-                if patched_file.is_removed_file:
-                    if os.path.exists(current_file_path):
-                        os.remove(current_file_path)
-                        logging.info(f"Removed file: {current_file_path}")
-                    else:
-                        logging.warning(
-                            f"File {current_file_path} does not exist for removal, skipping..."
-                        )
+    def _apply_patchset(self, patch_file_path: str) -> None:
+        """
+        Apply the patch line by line with unidiff.
+        """
+        # 解析补丁，直接逐行读取文件，不先读入整个字符串
+        with open(patch_file_path, "r", encoding="utf-8") as patch_file:
+            patchset = PatchSet(patch_file)
+        for patched_file in patchset:
+            # 确保文件路径中的非 ASCII 字符正确处理
+            current_file_path = _unquote_git_path(patched_file.path)
+            logging.info(f"Patching file {current_file_path}")
+
+            # remove
+            if patched_file.is_removed_file:
+                if os.path.exists(self._local_path(current_file_path)):
+                    os.remove(self._local_path(current_file_path))
+                    logging.info(f"Removed file: {current_file_path}")
+                else:
+                    logging.warning(
+                        f"File {current_file_path} does not exist for removal, skipping..."
+                    )
+                continue
+
+            # rename
+            if patched_file.is_rename:
+                # path 指向重命名后的文件，源文件需从 source_file 中去掉 a/ 前缀
+                target_file_path = current_file_path
+                current_file_path = _unquote_git_path(patched_file.source_file)
+                if current_file_path.startswith("a/"):
+                    current_file_path = current_file_path[2:]
+                if os.path.exists(self._local_path(current_file_path)):
+                    os.rename(
+                        self._local_path(current_file_path),
+                        self._local_path(target_file_path),
+                    )
+                    logging.info(
+                        f"Renamed file from {current_file_path} to {target_file_path}"
+                    )
+                else:
+                    logging.warning(
+                        f"File {current_file_path} does not exist for renaming, skipping..."
+                    )
                     continue
+                current_file_path = target_file_path
+
+            # add
+            # is_added_file 对已有文件开头的 "@@ -0,0 +1,N @@" 插入也为 True，需以 /dev/null 判断
+            if patched_file.source_file == "/dev/null":
+                # 新文件的内容就是全部新增行，无需读取和合并
+                new_lines = [
+                    diff_line.value
+                    for hunk in patched_file
+                    for diff_line in hunk
+                    if diff_line.line_type == LINE_TYPE_ADDED
+                ]
+                new_file_path = self._local_path(current_file_path)
+                os.makedirs(os.path.dirname(new_file_path), exist_ok=True)
+                _write_atomic(new_file_path, "".join(new_lines))
+                logging.info(f"Created new file: {current_file_path}")
+                continue
+
+            if not os.path.exists(self._local_path(current_file_path)):
+                logging.warning(f"File {current_file_path} does not exist, skipping...")
+                continue
 
-                # rename
-                if patched_file.is_rename:
-                    if os.path.exists(current_file_path):
-                        target_file_path = patched_file.target_file.encode(
-                            "utf-8"
-                        ).decode("unicode_escape")
-                        os.rename(current_file_path, target_file_path)
-                        logging.info(
-                            f"Renamed file from {current_file_path} to {target_file_path}"
-                        )
-                    else:
-                        logging.warning(
-                            f"File {current_file_path} does not exist for renaming, skipping..."
-                        )
-                        continue
-                    current_file_path = target_file_path
-
-                if not os.path.exists(current_file_path):
-                    # add
-                    if patched_file.is_added_file:
-                        with open(current_file_path, "w", encoding="utf-8") as new_file:
-                            new_file.write("")
-                        logging.info(f"Created new file: {current_file_path}")
-                    else:
-                        logging.warning(
-                            f"File {current_file_path} does not exist, skipping..."
-                        )
-                        continue
-
-                with open(current_file_path, "r", encoding="utf-8") as original_file:
-                    original_content = original_file.readlines()
-
-                # patch
-                # 倒序处理所有 hunk，先处理删除行
-                for hunk in reversed(list(patched_file)):
-                    # 先处理删除行，根据 source_line_no 从后往前删除
-                    for diff_line in reversed(hunk):
-                        if diff_line.is_removed:
-                            logging.debug(
-                                f"Removing line at {diff_line.source_line_no}: {diff_line.value.strip()}"
-                            )
-                            if isinstance(diff_line.source_line_no, int):
-                                original_content.pop(diff_line.source_line_no - 1)
-
-                # 正序处理所有 hunk，根据 target_line_no 从前往后处理添加行
-                for hunk in patched_file:
-                    for diff_line in hunk:
-                        if diff_line.is_added:
-                            logging.debug(
-                                f"Adding line at {diff_line.target_line_no}: {diff_line.value.strip()}"
-                            )
-                            if isinstance(diff_line.target_line_no, int):
-                                original_content.insert(
-                                    diff_line.target_line_no - 1, diff_line.value
-                                )
-
-                with open(current_file_path, "w", encoding="utf-8") as original_file:
-                    original_file.writelines(original_content)
-
-                logging.info(
-                    f"Patched file saved as {current_file_path.encode('unicode_escape').decode('utf-8')}"
-                )
+            with open(
+                self._local_path(current_file_path), "r", encoding="utf-8"
+            ) as original_file:
+                original_content = original_file.readlines()
+
+            # patch
+            # 按顺序遍历所有 hunk，线性合并出目标文件内容
+            patched_content, src_idx = [], 0
+            for hunk in patched_file:
+                # 复制 hunk 之前未改动的行；纯新增的 hunk 插入在 source_start 之后
+                hunk_start = hunk.source_start - (1 if hunk.source_length else 0)
+                patched_content.extend(original_content[src_idx:hunk_start])
+                src_idx = max(src_idx, hunk_start)
+                # 直接比较 line_type，避免 is_added 等属性在每行上的重复调用
+                for diff_line in hunk:
+                    line_type = diff_line.line_type
+                    if line_type == LINE_TYPE_REMOVED:
+                        src_idx += 1
+                    elif line_type == LINE_TYPE_ADDED:
+                        patched_content.append(diff_line.value)
+                    elif line_type == LINE_TYPE_CONTEXT:
+                        patched_content.append(original_content[src_idx])
+                        src_idx += 1
+            patched_content.extend(original_content[src_idx:])
+
+            _write_atomic(self._local_path(current_file_path), "".join(patched_content))
+
+            logging.info(
+                f"Patched file saved as {current_file_path} "
+                f"(+{patched_file.added} -{patched_file.removed} lines)"
+            )
 
-            with open("interface.json", "r+", encoding="utf-8") as file:
-                data = json.load(file)
-                data["version"] = self.latest_version
-                file.seek(0)  # Reset file pointer to the beginning
-                json.dump(data, file, indent=4, ensure_ascii=False)
-                file.truncate()  # Ensure the file is properly truncated
-            os.chdir(original_cwd)
+    def apply_patch(self) -> bool:
+        """
+        Apply the patch content to the local files.
+        """
+        try:
+            patch_file_path = os.path.abspath(
+                os.path.join(self.base_dir, self.diff_dir, self.diff_filename)
+            )
+            if not self._git_apply(patch_file_path):
+                self._apply_patchset(patch_file_path)
+
+            interface_path = self._local_path("interface.json")
+            with open(interface_path, "rb") as file:
+                data = _json_loads(file.read())
+            data["version"] = self.latest_version
+            _write_atomic(
+                interface_path, json.dumps(data, indent=4, ensure_ascii=False)
+            )
             return True
         except Exception as e:
             logging.error(f"An error occurred while applying the patch: {e}")
             return False
-        finally:
-            os.chdir(original_cwd)
 
     def patch(self) -> bool:
         """
         Get the diff content between two versions, process the diff, and then patch the local file.
         """
         try:
-            diff_content = self.get_diff_content()
-            if self.process_diff_content(diff_content):
-                if self.apply_patch():
-                    logging.info("Patch applied successfully.")
-                    return True
-                else:
-                    logging.error("Failed to apply the patch.")
+            self._fetch_and_write_diff()
+            if self.apply_patch():
+                logging.info("Patch applied successfully.")
+                return True
+            else:
+                logging.error("Failed to apply the patch.")
         except Exception as e:
             logging.error(f"An error occurred while patching: {e}")
         return False